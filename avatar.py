@@ -0,0 +1,112 @@
+"""Avatar cache for DiscordZ."""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils
+
+log = logging.getLogger(__name__)
+
+
+def avatar_key(user):
+    """Return the name under which a user's avatar is cached."""
+    return user.avatar or 'default%s' % user.default_avatar.value
+
+
+def avatar_url(user):
+    """Return the PNG URL of a user's avatar."""
+    url = user.avatar_url or user.default_avatar_url
+    return url.replace('.webp', '.png')
+
+
+class AvatarCache:
+    """Download avatars once, in a small thread pool sharing one HTTP session.
+
+    The cache directory is capped to `max_files` avatars, dropping the least
+    recently used ones first. Failed downloads aren't retried for `retry`
+    seconds.
+    """
+
+    def __init__(self, directory, workers=2, max_files=1000, retry=600):
+        self.directory = directory
+        self.max_files = max_files
+        self.retry = retry
+        os.makedirs(directory, exist_ok=True)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._failed = {}  # Key -> time of the failure
+        files = [entry for entry in os.scandir(directory) if entry.name.endswith('.png')]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        self._known = OrderedDict((entry.name[:-4], None) for entry in files)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def fetch(self, user):
+        """Make sure a user's avatar is cached, return its path."""
+        key = avatar_key(user)
+        with self._lock:
+            known = key in self._known
+            if known:
+                self._known.move_to_end(key)
+        if not known:
+            self.fetch_url(key, avatar_url(user))
+        return self.path(key)
+
+    def fetch_url(self, key, url):
+        """Download `url` as `key` unless cached or in flight, return a Future or None."""
+        with self._lock:
+            if key in self._known:
+                return None
+            failed = self._failed.get(key)
+            if failed is not None:
+                if time.monotonic() - failed < self.retry:
+                    return None
+                del self._failed[key]
+            future = self._pending.get(key)
+            if future is None:
+                future = self.executor.submit(self._download, key, url)
+                self._pending[key] = future
+        return future
+
+    def _download(self, key, url):
+        try:
+            response = self.session.get(url, timeout=10)
+            response.raise_for_status()
+            utils.write_atomic(self.path(key), response.content)
+        except (requests.RequestException, OSError) as error:
+            log.warning('could not download avatar %s: %s', key, error)
+            with self._lock:
+                del self._pending[key]
+                self._failed[key] = time.monotonic()
+            return False
+        except BaseException:
+            with self._lock:
+                del self._pending[key]
+            raise
+        with self._lock:
+            # Known before no longer pending, so nobody downloads it again
+            del self._pending[key]
+            self._known[key] = None
+            while len(self._known) > self.max_files:
+                old, _ = self._known.popitem(last=False)
+                try:
+                    os.remove(self.path(old))
+                except OSError:
+                    pass
+        return True
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Benchmarks for DiscordZ.
+
+Usage: ./bench.py [name...]  (runs every benchmark by default)
+"""
+import curses
+import datetime
+import fcntl
+import gc
+import os
+import pty
+import shutil
+import struct
+import sys
+import tempfile
+import termios
+import time
+import tracemalloc
+import unicodedata
+
+import store
+import subwin
+import theme
+import toml
+
+
+class FakeUser:
+    """Stand-in for discord.User, shared between the messages of a user."""
+
+    def __init__(self, number):
+        self.id = str(80351110224678912 + number)
+        self.name = 'user%d' % number
+        self.nick = None
+        self.avatar = '%032x' % number
+
+
+class FakeMessage:
+    """Stand-in for discord.Message, with the attributes discord.py sets."""
+
+    def __init__(self, number, author):
+        self.id = str(300000000000000000 + number)
+        self.author = author
+        self.content = 'message %d: the quick brown fox jumps over the lazy dog' % number
+        self.timestamp = datetime.datetime(2017, 1, 1) + datetime.timedelta(seconds=number)
+        self.edited_timestamp = None
+        self.tts = False
+        self.pinned = False
+        self.mention_everyone = False
+        self.embeds = []
+        self.attachments = []
+        self.mentions = []
+        self.role_mentions = []
+        self.channel_mentions = []
+        self.raw_mentions = []
+        self.raw_role_mentions = []
+        self.raw_channel_mentions = []
+        self.reactions = []
+        self.channel = None
+        self.server = None
+        self.nonce = None
+        self.call = None
+        self.type = 0
+
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, kept
+
+
+def bench_memory(count=100000):
+    """Memory held by `count` messages: discord.Message vs store.Record."""
+    users = [FakeUser(i) for i in range(50)]
+    messages, _ = _measure(lambda: [FakeMessage(i, users[i % 50]) for i in range(count)])
+    records, _ = _measure(lambda: [store.Record.from_message(FakeMessage(i, users[i % 50])) for i in range(count)])
+    print('memory: %d messages' % count)
+    print('  discord.Message  %8.1f MiB  %5d B/message' % (messages / 2**20, messages // count))
+    print('  store.Record     %8.1f MiB  %5d B/message' % (records / 2**20, records // count))
+
+
+class FramePad(subwin.Win):
+    """Chat box drawn the way WinPad does."""
+
+    def __init__(self, window):
+        super().__init__(window, None)
+        self.log = []
+
+    def draw(self):
+        rows = self.log[-self.height:]
+        for i, text in enumerate(rows):
+            self.put_line(i, text)
+        self.clear_lines(len(rows))
+
+
+class OldFramePad(FramePad):
+    """Chat box drawn the way WinPad did: clear, addstr, refresh."""
+
+    def draw(self):
+        self.win.clear()
+        for i, text in enumerate(self.log[-self.height:]):
+            self.addstr(i, 0, text)
+
+    def refresh(self):
+        if self._refresh:
+            self.win.refresh()
+            self._refresh = False
+
+
+def _frames(screen, pad_class, frames):
+    curses.curs_set(0)
+    height, width = screen.getmaxyx()
+    side = subwin.Win(screen.subwin(height, 20, 0, 0), None)
+    pad = pad_class(screen.subwin(height, width - 21, 0, 21))
+    pad.log = ['user%d: message number %d, some chatter to fill the line' % (i % 7, i) for i in range(100)]
+    boxes = [side, pad]
+    for box in boxes:
+        box.draw_()
+        box.refresh()
+    curses.doupdate()
+    for i in range(frames):
+        pad.log.append('user%d: a new message arrives (%d)' % (i % 7, i))
+        pad.redraw()
+        for box in boxes:
+            box.draw_()
+            box.refresh()
+        curses.doupdate()
+
+
+def _terminal_bytes(pad_class, frames, size=(50, 160)):
+    """Return the bytes a curses program drawing `frames` frames writes to its terminal."""
+    pid, master = pty.fork()
+    if pid == 0:
+        fcntl.ioctl(1, termios.TIOCSWINSZ, struct.pack('HHHH', size[0], size[1], 0, 0))
+        os.environ['TERM'] = 'xterm-256color'
+        curses.wrapper(_frames, pad_class, frames)
+        os._exit(0)
+    total = 0
+    while True:
+        try:
+            data = os.read(master, 65536)
+        except OSError:  # EIO once the child is gone
+            break
+        if not data:
+            break
+        total += len(data)
+    os.waitpid(pid, 0)
+    os.close(master)
+    return total
+
+
+def bench_frames(frames=200):
+    """Bytes sent to the terminal per frame when a message arrives."""
+    print('frames: %d new messages, 50x160 terminal' % frames)
+    for name, pad_class in (('clear + refresh', OldFramePad), ('put_line + doupdate', FramePad)):
+        base = _terminal_bytes(pad_class, 0)
+        total = _terminal_bytes(pad_class, frames)
+        print('  %-20s %8.0f B/frame' % (name, (total - base) / frames))
+
+
+def _old_check(text):
+    """subwin.check before caching."""
+    return ''.join([c for c in text if unicodedata.category(c) not in subwin.BLOCK])
+
+
+def bench_check(rounds=200):
+    """Sanitizing rows of mixed ASCII, CJK and emoji text."""
+    lines = ['user%d: plain ASCII message number %d' % (i, i) for i in range(40)]
+    lines += ['用户%d: 你好世界，今天的天气很好 %d' % (i, i) for i in range(40)]
+    lines += ['user%d: nice 👍🎉 ça marche \ue000 \U000e0fff %d' % (i, i) for i in range(40)]
+    assert all(subwin.check(line) == _old_check(line) for line in lines)
+    print('check: %d rows drawn %d times' % (len(lines), rounds))
+    for name, check in (('per character', _old_check), ('translate', subwin.check.__wrapped__),
+                        ('cached', subwin.check)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for line in lines:
+                check(line)
+        elapsed = time.perf_counter() - start
+        print('  %-14s %8.2f us/row' % (name, elapsed / rounds / len(lines) * 1e6))
+
+
+def bench_startup(rounds=200):
+    """Getting theme.toml ready for Theme: parsing it vs loading the compiled cache."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'theme.toml')
+        shutil.copy('theme.toml', path)
+        with open(path) as file:
+            text = file.read()
+        theme.load(path)
+        print('startup: theme.toml, %d rounds' % rounds)
+        for name, load in (('toml + DotMap', lambda: theme.compile_theme(toml.loads(text))),
+                           ('compiled cache', lambda: theme.load(path))):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                load()
+            elapsed = time.perf_counter() - start
+            print('  %-16s %8.3f ms' % (name, elapsed / rounds * 1e3))
+
+
+BENCHMARKS = {'memory': bench_memory, 'frames': bench_frames, 'check': bench_check, 'startup': bench_startup}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
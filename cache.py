@@ -0,0 +1,88 @@
+"""On-disk message cache for DiscordZ."""
+import sqlite3
+
+import store
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    channel TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    author_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    edited REAL,
+    mentions TEXT NOT NULL,
+    role_mentions TEXT NOT NULL,
+    everyone INTEGER NOT NULL,
+    PRIMARY KEY (channel, id)
+) WITHOUT ROWID
+'''
+COLUMNS = 'id, author, author_id, content, timestamp, edited, mentions, role_mentions, everyone'
+
+
+def _row(channel_id, record):
+    return (channel_id, int(record.id), record.author, record.author_id, record.content,
+            record.timestamp, record.edited, ' '.join(record.mentions),
+            ' '.join(record.role_mentions), int(record.everyone))
+
+
+def _record(row):
+    (message_id, author, author_id, content, timestamp, edited,
+     mentions, role_mentions, everyone) = row
+    return store.Record(str(message_id), author, author_id, content, timestamp, edited,
+                        store.intern_ids(mentions.split()), store.intern_ids(role_mentions.split()),
+                        bool(everyone))
+
+
+class DiskCache:
+    """SQLite database of messages, keyed by channel and snowflake."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        # Newest message of each channel when the session started,
+        # which is where catching up with Discord starts from
+        self.marks = {channel: str(newest) for (channel, newest) in
+                      self.db.execute('SELECT channel, MAX(id) FROM messages GROUP BY channel')}
+
+    def load(self, channel_id, limit, before=None):
+        """Return up to `limit` records of a channel, oldest first."""
+        if before is None:
+            rows = self.db.execute('SELECT %s FROM messages WHERE channel = ? ORDER BY id DESC LIMIT ?' % COLUMNS,
+                                   (channel_id, limit))
+        else:
+            rows = self.db.execute('SELECT %s FROM messages WHERE channel = ? AND id < ? '
+                                   'ORDER BY id DESC LIMIT ?' % COLUMNS, (channel_id, int(before), limit))
+        return [_record(row) for row in rows][::-1]
+
+    def save(self, channel_id, records):
+        """Insert or update records."""
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                [_row(channel_id, record) for record in records])
+
+    def update(self, channel_id, record):
+        """Update a record if it is cached, without adding it otherwise."""
+        row = _row(channel_id, record)
+        with self.db:
+            self.db.execute('UPDATE messages SET author = ?, author_id = ?, content = ?, timestamp = ?, edited = ?, '
+                            'mentions = ?, role_mentions = ?, everyone = ? WHERE channel = ? AND id = ?',
+                            row[2:] + row[:2])
+
+    def delete(self, channel_id, message_id):
+        """Forget a message."""
+        with self.db:
+            self.db.execute('DELETE FROM messages WHERE channel = ? AND id = ?', (channel_id, int(message_id)))
+
+    def clear(self, channel_id):
+        """Forget every message of a channel."""
+        with self.db:
+            self.db.execute('DELETE FROM messages WHERE channel = ?', (channel_id,))
+        self.marks.pop(channel_id, None)
+
+    def close(self):
+        self.db.close()
@@ -2,15 +2,23 @@
 """Discord app."""
 import asyncio
 import curses
+import logging
 import os
-import subprocess
+import sys
+import time
 
 import discord
-import requests
 
+import avatar
+import events
+import logs
+import mention
+import notify
 import theme as thm
 import ui as UI
 
+log = logging.getLogger(__name__)
+
 
 class Client(discord.Client):
     """Wrapper around discord.Client class."""
@@ -20,6 +28,11 @@ class Client(discord.Client):
         self.callback = callback
         self.theme = theme
         self.ui = None
+        self.avatars = None
+        self.notifier = None
+        self.keywords = ()
+        self.matchers = {}  # Server id (None for DMs) -> mention.Matcher
+        self.ready_time = None
 
     def set_ui(self, ui):
         """UI setter."""
@@ -29,56 +42,87 @@ class Client(discord.Client):
         """Return the wrapper.Channel object of a message."""
         if self.ui is None:
             return None
-        if message.channel.is_private:
-            server = self.ui.servers[0]
-        else:
-            server = self.ui.servers.get(message.server.id)
-        if server is None:
+        chan = self.ui.account.channels.get(message.channel.id)
+        if chan is None:
+            # The server may not have been loaded yet
+            server = self.serv(message.channel)
+            if server is not None and not server.loaded:
+                server.load()
+                chan = server[message.channel.id]
+        return chan
+
+    def serv(self, channel):
+        """Return the wrapper.Server object of a discord channel."""
+        if self.ui is None:
             return None
-        return server[message.channel.id]
+        if channel.is_private:
+            return self.ui.servers[0]
+        return self.ui.servers.get(channel.server.id)
+
+    def matcher(self, server):
+        """Return the mention matcher of a discord server (None for DMs)."""
+        key = None if server is None else server.id
+        matcher = self.matchers.get(key)
+        if matcher is None:
+            matcher = self.matchers[key] = mention.Matcher.for_server(server, self.user, self.keywords)
+        return matcher
+
+    def channels_changed(self, server, channel):
+        """Refresh the UI after a channel was created, deleted or updated."""
+        if channel is not None and channel is self.ui.channel and channel.id not in self.ui.account.channels:
+            self.ui.set_channel(server.default_channel)
+            self.ui.pad.redraw()
+            self.ui.status.redraw()
+        if server is self.ui.server:
+            self.ui.chan.update()
+        self.ui.schedule()
+
+    async def on_channel_create(self, channel):
+        """Add channel to its server."""
+        server = self.serv(channel)
+        if server is None or not server.loaded:
+            return
+        self.channels_changed(server, server.add_channel(channel))
+
+    async def on_channel_delete(self, channel):
+        """Remove channel from its server."""
+        server = self.serv(channel)
+        if server is None or not server.loaded:
+            return
+        self.channels_changed(server, server.remove_channel(channel))
+
+    async def on_channel_update(self, before, after):
+        """Rename or move channel."""
+        server = self.serv(after)
+        if server is None or not server.loaded:
+            return
+        self.channels_changed(server, server.update_channel(after))
 
     async def on_message(self, message):
         """Add message to channel and handle mentions."""
         # Download avatar to cache
-        asyncio.get_event_loop().run_in_executor(None, download_avatar, message.author)
+        icon = None
+        if self.avatars is not None:
+            icon = self.avatars.fetch(message.author)
 
         chan = self.chan(message)
         if chan is None:
             return
-        print(message.author.name, message.content, file=open('log', 'a'))
+        log.debug('%s: %s', message.author.name, message.content)
         chan.add_message(message)
-        if chan == self.ui.channel:
-            self.ui.pad.redraw()
-        else:
-            mentioned = False
-            # Direct mentions
-            if any([member for member in message.mentions if member.id == self.user.id]):
-                mentioned = True
-            # Role mentions
-            if message.server is not None:
-                roles = message.server.get_member(self.user.id).roles
-                if any([r in roles for r in message.role_mentions]):
-                    mentioned = True
-            # @everyone / @here mentions
-            if '@everyone' in message.content or '@here' in message.content:
-                mentioned = True
-            # Direct messages
-            if message.channel.is_private:
-                mentioned = True
+        if chan != self.ui.channel:
+            # Every direct message counts as a mention
+            mentioned = message.channel.is_private or self.matcher(message.server).match(message)
             if mentioned and message.author.id != self.user.id:
                 chan.mentions += 1
-                # Desktop notifications (Linux only)
-                subprocess.Popen(['notify-send',
-                                  '-i', '/tmp/%s.png' % message.author.avatar,
-                                  message.author.name, message.clean_content])
-            # If we're currently focusing the server in which the message happened
-            if self.ui.server is not None and ((message.server is None and self.ui.server.id == 0) or
-                                               (message.server is not None and message.server.id == self.ui.server.id)):
-                self.ui.chan.redraw()
-            self.ui.serv.redraw()
+                if self.notifier is not None:
+                    self.notifier.notify(chan.id, chan.display_name, message.author.name,
+                                         message.clean_content, icon)
             chan.unread = True
-        self.ui.draw()
-        self.ui.refresh()
+        # Sending a message ends typing
+        self.ui.events.push(events.TYPING, (chan.id, message.author.id), None)
+        self.ui.events.push(events.ACTIVITY, chan.id, chan)
+        self.ui.schedule()
 
     async def on_message_delete(self, message):
         """Delete message from channel."""
@@ -87,9 +131,8 @@ class Client(discord.Client):
             return
         chan.delete_message(message)
         if chan == self.ui.channel:
-            self.ui.pad.redraw()
-            self.ui.draw()
-            self.ui.refresh()
+            self.ui.events.push(events.ACTIVITY, chan.id, chan)
+            self.ui.schedule()
 
     async def on_message_edit(self, before, after):
         """Edit message in channel."""
@@ -98,12 +141,53 @@ class Client(discord.Client):
             return
         chan.edit_message(before, after)
         if chan == self.ui.channel:
-            self.ui.pad.redraw()
-            self.ui.draw()
-            self.ui.refresh()
+            self.ui.events.push(events.ACTIVITY, chan.id, chan)
+            self.ui.schedule()
+
+    def member_changed(self, member, present=True):
+        """Queue a member list change for the next frame."""
+        if self.ui is None:
+            return
+        self.ui.events.push(events.MEMBER, (member.server.id, member.id), (member, present))
+        self.ui.schedule()
+
+    async def on_member_join(self, member):
+        """Add member to its server's member list."""
+        self.member_changed(member)
+
+    async def on_member_remove(self, member):
+        """Remove member from its server's member list."""
+        self.member_changed(member, False)
+
+    async def on_member_update(self, before, after):
+        """Move member in the member list, forget mention matcher if our roles changed."""
+        if after.id == self.user.id:
+            self.matchers.pop(after.server.id, None)
+        self.member_changed(after)
+
+    async def on_typing(self, channel, user, when):
+        """Show who is typing in the status bar."""
+        if self.ui is None or user.id == self.user.id:
+            return
+        name = getattr(user, 'display_name', user.name)
+        self.ui.events.push(events.TYPING, (channel.id, user.id), (name, time.monotonic()))
+        self.ui.schedule()
+
+    async def on_server_role_update(self, before, after):
+        """Forget mention matcher of the role's server."""
+        self.matchers.pop(after.server.id, None)
+
+    async def on_server_role_delete(self, role):
+        """Forget mention matcher of the role's server."""
+        self.matchers.pop(role.server.id, None)
+
+    async def on_server_remove(self, server):
+        """Forget mention matcher of a server we left."""
+        self.matchers.pop(server.id, None)
 
     async def on_ready(self):
         """Discord client initialization, main function wrapper."""
+        self.ready_time = time.perf_counter()
         window = None
         try:
             window = curses.initscr()
@@ -111,7 +195,17 @@ class Client(discord.Client):
             curses.raw()            # Catch Ctrl+S, Ctrl+Z and such
             window.keypad(True)     # Catch Ctrl+Down as one key
             curses.start_color()    # Custom colors
-            await self.callback(window, thm.Theme(self.theme), self)
+            theme = thm.Theme(self.theme)
+            logs.setup(theme.log)
+            config = theme.avatars
+            self.avatars = avatar.AvatarCache(config.path, config.workers, config.files)
+            config = theme.notify
+            self.keywords = tuple(config.keywords)
+            self.matchers = {}
+            if config.backend:
+                self.notifier = notify.Notifier(notify.BACKENDS[config.backend](), config.window, config.interval)
+                self.notifier.start()
+            await self.callback(window, theme, self)
         finally:
             if window is not None:
                 window.keypad(False)
@@ -119,28 +213,24 @@ class Client(discord.Client):
                 curses.nocbreak()
                 curses.endwin()
             await self.logout()
+            if self.avatars is not None:
+                self.avatars.close()
+            if self.notifier is not None:
+                self.notifier.stop()
+            logs.stop()
 
 
-def download_avatar(user):
-    """Download a user's avatar to /tmp/ if not already done."""
-    filename = '/tmp/%s.png' % user.avatar
-    if os.path.exists(filename):
-        return
-    url = user.avatar_url or user.default_avatar_url
-    url = url.replace('.webp', '.png')
-    file = requests.get(url)
-    open(filename, 'wb').write(file.content)
-
-
-def getch(window):
-    """Return the key pressed."""
-    key = -1
-    while key == -1:
+def read_keys(window):
+    """Return every key waiting to be read (the window must be in nodelay mode)."""
+    keys = []
+    while True:
         try:
             key = window.getch()
         except KeyboardInterrupt:
             key = 3
-    return key
+        if key == -1:
+            return keys
+        keys.append(key)
 
 
 async def main(window, theme, client):
@@ -150,20 +240,32 @@ async def main(window, theme, client):
 
     theme.refresh_layout(window)
 
-    key = -1
-
     win = UI.UI(window, theme, client)
-    await win.update()
     client.set_ui(win)
+    win.draw()
+    win.refresh()
+    log.info('First frame drawn %.3fs after on_ready', time.perf_counter() - client.ready_time)
+    win.start()
 
-    while key != 17:  # Ctrl+Q
-        if key != -1:
-            win.press(key)
-        await win.do()  # Queue
-        win.draw()
-        win.refresh()
-        # Blocking for a key press, but letting discord.py run
-        key = await asyncio.get_event_loop().run_in_executor(None, getch, window)
+    # Wake up when stdin is readable instead of blocking a thread on getch
+    loop = asyncio.get_event_loop()
+    ready = asyncio.Event()
+    window.nodelay(True)
+    loop.add_reader(sys.stdin.fileno(), ready.set)
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            # Handle a whole paste or key-repeat burst before drawing
+            for key in read_keys(window):
+                if key == 17:  # Ctrl+Q
+                    return
+                win.press(key)
+            win.schedule()
+    finally:
+        loop.remove_reader(sys.stdin.fileno())
+        win.stop()
+        log.info('UI: %s', win.events.stats())
 
 
 def _run():
@@ -0,0 +1,39 @@
+"""Event coalescing between the Discord client and the UI."""
+
+# Kinds of events
+MEMBER = 'member'      # (server id, member id) -> (member, present)
+TYPING = 'typing'      # (channel id, user id) -> (name, time)
+ACTIVITY = 'activity'  # channel id -> wrapper.Channel with new, edited or deleted messages
+
+
+class Coalescer:
+    """Keep the latest state of each (kind, key) until the next frame takes them.
+
+    A member changing status five times between two frames is drawn once,
+    with its last status.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self.received = 0
+        self.applied = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, kind, key, value):
+        self.received += 1
+        self._pending[kind, key] = value
+
+    def drain(self):
+        """Return the pending changes as {kind: {key: value}} and forget them."""
+        changes = {}
+        for (kind, key), value in self._pending.items():
+            changes.setdefault(kind, {})[key] = value
+        self.applied += len(self._pending)
+        self._pending = {}
+        return changes
+
+    def stats(self):
+        saved = 1 - self.applied / self.received if self.received else 0
+        return '%d events received, %d applied (%.0f%% coalesced)' % (self.received, self.applied, saved * 100)
@@ -0,0 +1,115 @@
+"""Logging for DiscordZ.
+
+Records go through a bounded in-memory queue and are written to disk in
+batches by a background thread, so logging from the event loop never
+touches the file system.
+"""
+import logging
+import os
+import queue
+import threading
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class QueueHandler(logging.Handler):
+    """Handler putting records in a queue, dropping them when it is full."""
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Writer(threading.Thread):
+    """Background thread writing queued records, with size-based rotation."""
+
+    def __init__(self, records, path, max_bytes=0, backups=0, batch=256):
+        super().__init__(name='log-writer', daemon=True)
+        self.records = records
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch = batch
+        self.formatter = logging.Formatter(FORMAT)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            self.write(batch)
+        self.file.close()
+
+    def write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record) + '\n')
+            except Exception:  # Broken record, don't kill the writer
+                pass
+        text = ''.join(lines)
+        if not text:
+            return
+        size = len(text.encode('utf-8'))
+        if self.max_bytes and self.size and self.size + size > self.max_bytes:
+            self.rotate()
+        self.file.write(text)
+        self.file.flush()
+        self.size += size
+
+    def rotate(self):
+        """Move log to log.1, log.1 to log.2 and so on."""
+        self.file.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists('%s.%d' % (self.path, i)):
+                    os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.size = 0
+
+
+_records = None
+_writer = None
+
+
+def setup(config):
+    """Start logging to a file, as described by the `log` theme section."""
+    global _records, _writer
+    if _writer is not None or not config.path:
+        return
+    _records = queue.Queue(config.queue)
+    _writer = Writer(_records, config.path, config.size, config.backups)
+    _writer.start()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(_records))
+    root.setLevel(config.level.upper())
+
+
+def stop(timeout=1):
+    """Write pending records and stop the writer."""
+    global _writer
+    if _writer is None:
+        return
+    try:
+        _records.put(None, timeout=timeout)
+    except queue.Full:
+        pass
+    _writer.join(timeout)
+    _writer = None
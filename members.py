@@ -0,0 +1,67 @@
+"""Member lists for DiscordZ."""
+import bisect
+
+# Members are listed by status, in this order
+STATUS_ORDER = {'online': 0, 'idle': 1, 'dnd': 2, 'offline': 3, 'invisible': 3}
+
+
+def status(member):
+    """Return the status of a member as a string."""
+    return str(member.status)
+
+
+class MemberList:
+    """Members of a server, kept sorted by status then name.
+
+    Joins, leaves and presence changes are applied with a binary search
+    for the member's old and new places instead of sorting again.
+    """
+
+    def __init__(self, members=()):
+        entries = sorted((self.key(member), member) for member in members)
+        self._keys = [key for (key, _) in entries]
+        self._members = [member for (_, member) in entries]
+        self._by_id = {member.id: key for (key, member) in zip(self._keys, self._members)}
+        self.version = 0  # Bumped on every change
+
+    @staticmethod
+    def key(member):
+        return (STATUS_ORDER.get(status(member), 3), member.display_name.lower(), member.id)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __getitem__(self, position):
+        return self._members[position]
+
+    def __contains__(self, member):
+        return member.id in self._by_id
+
+    def add(self, member):
+        if member.id in self._by_id:
+            self.remove(member)
+        key = self.key(member)
+        position = bisect.bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._members.insert(position, member)
+        self._by_id[member.id] = key
+        self.version += 1
+
+    def remove(self, member):
+        key = self._by_id.pop(member.id, None)
+        if key is None:
+            return
+        position = bisect.bisect_left(self._keys, key)
+        del self._keys[position]
+        del self._members[position]
+        self.version += 1
+
+    def update(self, member):
+        """Move a member after a status or name change."""
+        if self._by_id.get(member.id) == self.key(member):
+            # Same place, just keep the newest object
+            position = bisect.bisect_left(self._keys, self._by_id[member.id])
+            self._members[position] = member
+            self.version += 1
+        else:
+            self.add(member)
@@ -0,0 +1,43 @@
+"""Mention detection for DiscordZ."""
+import re
+
+
+class Matcher:
+    """Decide whether a message mentions us, for a given server.
+
+    Built once per server from our user id, the ids of our roles there and
+    the highlight keywords, then reused for every message.
+    """
+
+    def __init__(self, user_id, role_ids=(), keywords=()):
+        self.user_id = user_id
+        self.role_ids = frozenset(role_ids)
+        self.keywords = None
+        if keywords:
+            pattern = '|'.join(re.escape(keyword) for keyword in keywords)
+            # Not \b: keywords may start or end with a symbol (@oncall, c++)
+            self.keywords = re.compile(r'(?<!\w)(?:%s)(?!\w)' % pattern, re.IGNORECASE)
+
+    @classmethod
+    def for_server(cls, server, user, keywords=()):
+        """Build the matcher of `user` in a discord.Server (None for DMs)."""
+        if server is None:
+            return cls(user.id, (), keywords)
+        member = server.get_member(user.id)
+        roles = () if member is None else [role.id for role in member.roles]
+        return cls(user.id, roles, keywords)
+
+    def match(self, message):
+        """Return why a message mentions us ('everyone', 'user', 'role', 'keyword') or None."""
+        if message.mention_everyone:  # Also set for @here
+            return 'everyone'
+        for user in message.mentions:
+            if user.id == self.user_id:
+                return 'user'
+        if self.role_ids:
+            for role in message.role_mentions:
+                if role.id in self.role_ids:
+                    return 'role'
+        if self.keywords is not None and self.keywords.search(message.content):
+            return 'keyword'
+        return None
@@ -0,0 +1,110 @@
+"""Desktop notifications for DiscordZ."""
+from collections import OrderedDict
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class NotifySend:
+    """Backend showing notifications with notify-send (Linux only)."""
+
+    def __call__(self, title, body, icon=None):
+        command = ['notify-send']
+        if icon:
+            command.extend(['-i', icon])
+        command.extend([title, body])
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+
+
+BACKENDS = {'notify-send': NotifySend}
+
+
+class Group:
+    """Mentions of a channel waiting to be shown."""
+    __slots__ = ('deadline', 'count', 'place', 'title', 'body', 'icon')
+
+    def __init__(self, deadline, place):
+        self.deadline = deadline
+        self.place = place
+        self.count = 0
+        self.title = self.body = self.icon = None
+
+
+class Notifier(threading.Thread):
+    """Worker thread sending notifications through `backend`.
+
+    The first mention of a channel is shown right away; the next ones
+    within `window` seconds are grouped into a single notification.
+    At most one notification is sent every `interval` seconds.
+    """
+
+    def __init__(self, backend, window=2.0, interval=1.0):
+        super().__init__(name='notifier', daemon=True)
+        self.backend = backend
+        self.window = window
+        self.interval = interval
+        self.sent = 0
+        self._events = queue.Queue()
+        self._groups = OrderedDict()
+        self._quiet = {}  # Channel -> end of its grouping window
+        self._last = 0
+
+    def notify(self, key, place, title, body, icon=None):
+        """Queue a mention of channel `key`, named `place`."""
+        self._events.put((key, place, title, body, icon))
+
+    def stop(self, timeout=1):
+        self._events.put(None)
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            try:
+                event = self._events.get(timeout=self._timeout())
+            except queue.Empty:
+                pass
+            else:
+                if event is None:
+                    return
+                self._add(*event)
+            self._send_due()
+
+    def _timeout(self):
+        if not self._groups:
+            return None
+        deadline = min(group.deadline for group in self._groups.values())
+        return max(0, max(deadline, self._last + self.interval) - time.monotonic())
+
+    def _add(self, key, place, title, body, icon):
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = Group(max(time.monotonic(), self._quiet.get(key, 0)), place)
+        group.count += 1
+        group.title, group.body, group.icon = title, body, icon
+
+    def _send_due(self):
+        now = time.monotonic()
+        if now < self._last + self.interval:
+            return
+        for key, group in self._groups.items():
+            if group.deadline <= now:
+                break
+        else:
+            return
+        del self._groups[key]
+        self._quiet[key] = now + self.window
+        if group.count == 1:
+            title, body = group.title, group.body
+        else:
+            title = '%d new mentions in %s' % (group.count, group.place)
+            body = '%s: %s' % (group.title, group.body)
+        self._last = now
+        self.sent += 1
+        try:
+            self.backend(title, body, group.icon)
+        except Exception as error:  # A broken backend shouldn't stop the worker
+            log.warning('notification failed: %s', error)
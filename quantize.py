@@ -0,0 +1,70 @@
+"""Nearest xterm-256 colors, for terminals that can't redefine their palette."""
+import functools
+
+# xterm's default first 16 colors, as (red, green, blue) from 0 to 255
+BASIC = ((0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+         (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+         (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+         (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255))
+CUBE = (0, 95, 135, 175, 215, 255)
+GRAYS = tuple(8 + 10 * i for i in range(24))
+
+PALETTE = (BASIC +
+           tuple((red, green, blue) for red in CUBE for green in CUBE for blue in CUBE) +
+           tuple((gray, gray, gray) for gray in GRAYS))
+
+
+def _linear(component):
+    component /= 255
+    if component <= 0.04045:
+        return component / 12.92
+    return ((component + 0.055) / 1.055) ** 2.4
+
+
+def _f(t):
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def lab(red, green, blue):
+    """Return the CIE L*a*b* coordinates of an sRGB color (components up to 255)."""
+    red, green, blue = _linear(red), _linear(green), _linear(blue)
+    # sRGB to XYZ, relative to the D65 white point
+    x = (0.4124 * red + 0.3576 * green + 0.1805 * blue) / 0.95047
+    y = 0.2126 * red + 0.7152 * green + 0.0722 * blue
+    z = (0.0193 * red + 0.1192 * green + 0.9505 * blue) / 1.08883
+    x, y, z = _f(x), _f(y), _f(z)
+    return 116 * y - 16, 500 * (x - y), 200 * (y - z)
+
+
+@functools.lru_cache(maxsize=None)
+def _palette(colors):
+    """Return (code, lab) for the palette entries to pick from on a `colors` color terminal."""
+    if colors >= len(PALETTE):
+        # The first 16 colors are often changed by terminal themes, avoid them
+        codes = range(16, len(PALETTE))
+    else:
+        codes = range(min(colors, 16))
+    return tuple((code, lab(*PALETTE[code])) for code in codes)
+
+
+@functools.lru_cache(maxsize=4096)
+def nearest(red, green, blue, colors=256):
+    """Return the palette color closest to an RGB color (components up to 1000, as curses)."""
+    return _nearest(lab(red * 255 / 1000, green * 255 / 1000, blue * 255 / 1000), colors)
+
+
+@functools.lru_cache(maxsize=None)
+def nearest_code(code, colors=256):
+    """Return the color closest to xterm color `code` among the first `colors` ones."""
+    if code < colors:
+        return code
+    return _nearest(lab(*PALETTE[code]), colors)
+
+
+def _nearest(target, colors):
+    best, best_distance = 0, None
+    for code, (l, a, b) in _palette(colors):
+        distance = (l - target[0]) ** 2 + (a - target[1]) ** 2 + (b - target[2]) ** 2
+        if best_distance is None or distance < best_distance:
+            best, best_distance = code, distance
+    return best
@@ -0,0 +1,239 @@
+"""Message storage for DiscordZ."""
+import bisect
+from collections import OrderedDict
+import sys
+
+NO_IDS = ()
+
+
+def snowflake(message):
+    """Return the sort key of a message (Discord ids grow with time)."""
+    return int(message.id)
+
+
+def footprint(message):
+    """Return the approximate memory used by a message, in bytes."""
+    return RECORD_SIZE + sys.getsizeof(message.content)
+
+
+def intern_ids(ids):
+    """Return a tuple of interned ids."""
+    return tuple(sys.intern(i) for i in ids) or NO_IDS
+
+
+class Record:
+    """What DiscordZ keeps of a discord.Message.
+
+    Author names and ids are interned, so they are shared between all the
+    messages of a user instead of being stored once per message.
+    """
+    __slots__ = ('id', 'author', 'author_id', 'content', 'timestamp', 'edited',
+                 'mentions', 'role_mentions', 'everyone')
+
+    def __init__(self, id, author, author_id, content, timestamp, edited=None,
+                 mentions=NO_IDS, role_mentions=NO_IDS, everyone=False):
+        self.id = id
+        self.author = author
+        self.author_id = author_id
+        self.content = content
+        self.timestamp = timestamp
+        self.edited = edited
+        self.mentions = mentions
+        self.role_mentions = role_mentions
+        self.everyone = everyone
+
+    @classmethod
+    def from_message(cls, message):
+        """Build a record from a discord.Message."""
+        author = message.author
+        # Members have a nickname, plain users don't
+        name = getattr(author, 'nick', None) or author.name
+        edited = message.edited_timestamp
+        return cls(message.id, sys.intern(name), sys.intern(author.id), message.content or '',
+                   message.timestamp.timestamp(), None if edited is None else edited.timestamp(),
+                   intern_ids(user.id for user in message.mentions),
+                   intern_ids(role.id for role in message.role_mentions), bool(message.mention_everyone))
+
+
+RECORD_SIZE = sys.getsizeof(Record('0', '', '', '', 0.0))
+
+
+class MessageStore:
+    """Messages of a channel, indexed by id and kept sorted oldest first.
+
+    When `limit` is set the store acts as a ring buffer, dropping its
+    oldest messages to stay under `limit`.
+    """
+
+    def __init__(self, limit=None, history=None):
+        self.limit = limit
+        self.history = history
+        self.bytes = 0
+        self._keys = []
+        self._messages = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __contains__(self, message):
+        return message.id in self._index
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, position):
+        return self._messages[position]
+
+    def get(self, message_id):
+        """Return the message with this id, or None."""
+        return self._index.get(message_id)
+
+    def position(self, message):
+        """Return the position of a message, or -1 if it isn't stored."""
+        if message.id not in self._index:
+            return -1
+        return bisect.bisect_left(self._keys, snowflake(message))
+
+    def oldest(self):
+        """Return the oldest stored message, or None."""
+        return self._messages[0] if self._messages else None
+
+    def add(self, message):
+        """Insert a message at its place, return False if already stored."""
+        if message.id in self._index:
+            return False
+        key = snowflake(message)
+        if not self._keys or key > self._keys[-1]:
+            # Live messages nearly always arrive in order
+            self._keys.append(key)
+            self._messages.append(message)
+        else:
+            position = bisect.bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._messages.insert(position, message)
+        self._index[message.id] = message
+        self._resize(1, footprint(message))
+        if self.limit is not None and len(self._messages) > self.limit:
+            self.trim(self.limit)
+        return True
+
+    def replace(self, message):
+        """Replace the stored message having the same id."""
+        position = self.position(message)
+        if position == -1:
+            return False
+        self._resize(0, footprint(message) - footprint(self._messages[position]))
+        self._messages[position] = message
+        self._index[message.id] = message
+        return True
+
+    def remove(self, message):
+        """Remove a message, return False if it wasn't stored."""
+        position = self.position(message)
+        if position == -1:
+            return False
+        self._resize(-1, -footprint(self._messages[position]))
+        del self._keys[position]
+        del self._messages[position]
+        del self._index[message.id]
+        return True
+
+    def trim(self, count):
+        """Keep only the newest `count` messages."""
+        dropped = len(self._messages) - count
+        if dropped <= 0:
+            return
+        size = 0
+        for message in self._messages[:dropped]:
+            del self._index[message.id]
+            size += footprint(message)
+        del self._keys[:dropped]
+        del self._messages[:dropped]
+        self._resize(-dropped, -size)
+
+    def clear(self):
+        """Drop every message."""
+        self._resize(-len(self._messages), -self.bytes)
+        self._keys = []
+        self._messages = []
+        self._index = {}
+
+    def _resize(self, count, size):
+        self.bytes += size
+        if self.history is not None:
+            self.history.resize(self, count, size)
+
+
+class History:
+    """Message budget shared by every channel.
+
+    Histories of channels that aren't focused are dropped, least recently
+    used first, whenever the total goes over `messages` (or `size` bytes,
+    if non-zero). Each channel is also capped to `channel` messages.
+    Messages are also written to `cache` (a cache.DiskCache) if given.
+    """
+
+    def __init__(self, messages, size=0, channel=None, cache=None):
+        self.max_messages = messages
+        self.max_bytes = size
+        self.channel_limit = channel
+        self.cache = cache
+        self.messages = 0
+        self.bytes = 0
+        self._stores = OrderedDict()
+        self._pinned = set()
+
+    def open(self):
+        """Return a new message store accounted in this history."""
+        messages = MessageStore(self.channel_limit, self)
+        self._stores[id(messages)] = messages
+        return messages
+
+    def close(self, messages):
+        """Stop tracking a store, dropping its messages."""
+        messages.clear()
+        self._stores.pop(id(messages), None)
+        self._pinned.discard(id(messages))
+        messages.history = None
+
+    def pin(self, messages):
+        """Protect a store from eviction (used for the focused channel)."""
+        self._pinned.add(id(messages))
+        self.touch(messages)
+
+    def unpin(self, messages):
+        """Allow a store to be evicted again, dropping its scrollback."""
+        self._pinned.discard(id(messages))
+        messages.limit = self.channel_limit
+        if messages.limit is not None:
+            messages.trim(messages.limit)
+        self.touch(messages)
+
+    def touch(self, messages):
+        """Mark a store as the most recently used."""
+        if id(messages) in self._stores:
+            self._stores.move_to_end(id(messages))
+
+    def over_budget(self):
+        if self.max_messages and self.messages > self.max_messages:
+            return True
+        return bool(self.max_bytes) and self.bytes > self.max_bytes
+
+    def resize(self, messages, count, size):
+        """Account for messages added to or removed from a store."""
+        self.messages += count
+        self.bytes += size
+        if count > 0:
+            # Receiving messages counts as a use
+            self.touch(messages)
+            if self.over_budget():
+                self.evict(messages)
+
+    def evict(self, keep=None):
+        """Drop least recently used histories until under budget, except `keep`."""
+        for key, messages in list(self._stores.items()):
+            if not self.over_budget():
+                break
+            if key not in self._pinned and messages is not keep and len(messages):
+                messages.clear()
@@ -1,14 +1,35 @@
 """Wrapper around curses.window class."""
+import bisect
 import curses
+import functools
+import re
 import string
+import time
 import unicodedata
 
+import textlayout
+
 BLOCK = ('Cn', 'Co', 'Cs')
 
 
+class _Blocked(dict):
+    """str.translate table dropping BLOCK characters, filled as they are met."""
+
+    def __missing__(self, code):
+        value = None if unicodedata.category(chr(code)) in BLOCK else code
+        self[code] = value
+        return value
+
+
+_BLOCKED = _Blocked()
+
+
+@functools.lru_cache(maxsize=4096)
 def check(text):
     """Strip away unprintable Unicode from string."""
-    return ''.join([c for c in text if unicodedata.category(c) not in BLOCK])
+    if textlayout.is_ascii(text):  # No unassigned, private or surrogate characters there
+        return text
+    return text.translate(_BLOCKED)
 
 
 class Win:
@@ -34,6 +55,7 @@ class Win:
         self.height, self.width = window.getmaxyx()
         self._redraw = True
         self._refresh = False
+        self._lines = {}  # Row -> what put_line last wrote there
         self.focused = False
 
     def __getattr__(self, key):
@@ -44,13 +66,26 @@ class Win:
         """Mark for redraw."""
         self._redraw = True
 
+    def needs_redraw(self):
+        return self._redraw
+
     def refresh(self):
-        """Refresh window if needed."""
+        """Stage window for the next curses.doupdate, if needed."""
         if not self._refresh:
             return
-        self.win.refresh()
+        self.win.noutrefresh()
         self._refresh = False
 
+    def clear(self):
+        """Clear window, repainting the whole of it on the next update."""
+        self.win.clear()
+        self._lines = {}
+
+    def erase(self):
+        """Blank window."""
+        self.win.erase()
+        self._lines = {}
+
     def update_rect(self, theme):
         rect = self.get_rect(theme)
         self.win.mvderwin(rect.y, rect.x)
@@ -58,6 +93,7 @@ class Win:
         self.win.mvwin(rect.y, rect.x)
         self.y, self.x = self.win.getparyx()
         self.height, self.width = self.win.getmaxyx()
+        self._lines = {}
         self.redraw()
 
     def addstr(self, row, col, string, attr=0):
@@ -68,12 +104,30 @@ class Win:
             pass
 
     def addlnstr(self, row, col, string, length, attr=0):
-        """Window.addnstr wrapper using ljust and handling curses.error."""
+        """Window.addstr wrapper fitting string to `length` cells and handling curses.error."""
         try:
-            self.win.addnstr(row, col, check(string).ljust(length), length, attr)
+            self.win.addstr(row, col, textlayout.fit(check(string), length), attr)
         except curses.error:
             pass
 
+    def put_line(self, row, string, attr=0, tag=None):
+        """Write a whole row unless it already holds the same thing.
+
+        `tag` stands for anything the caller draws over the row, which
+        should only be drawn again when this returns True.
+        """
+        line = (string, attr, tag)
+        if self._lines.get(row) == line:
+            return False
+        self._lines[row] = line
+        self.addlnstr(row, 0, string, self.width, attr)
+        return True
+
+    def clear_lines(self, start=0):
+        """Blank every row from `start` down."""
+        for row in range(start, self.height):
+            self.put_line(row, '')
+
     def press(self, key):
         pass
 
@@ -97,28 +151,100 @@ class Win:
         self._refresh = True
 
     def draw(self):
-        self.win.clear()
+        self.erase()
         self.addstr(0, 0, self.__class__.__name__ + ('focus' if self.focused else 'nope'))
         self.addstr(1, 0, ','.join(map(str, (self.x, self.y, self.width, self.height))))
 
 
+class KeyIndex:
+    """Lowercased keys of a list, sorted for type-ahead search."""
+
+    def __init__(self, keys):
+        self.keys = [key.lower() for key in keys]
+        pairs = sorted((key, i) for (i, key) in enumerate(self.keys))
+        self._sorted = [key for (key, _) in pairs]
+        self._positions = [i for (_, i) in pairs]
+
+    def find(self, text, match='prefix'):
+        """Return the positions of keys matching text, in list order.
+
+        `match` is 'prefix', 'substring' or 'fuzzy' (letters in order).
+        """
+        text = text.lower()
+        if match == 'prefix':
+            start = bisect.bisect_left(self._sorted, text)
+            end = bisect.bisect_left(self._sorted, text + '\U0010ffff', start)
+            return sorted(self._positions[start:end])
+        if match == 'substring':
+            return [i for (i, key) in enumerate(self.keys) if text in key]
+        pattern = re.compile('.*?'.join(map(re.escape, text)))
+        return [i for (i, key) in enumerate(self.keys) if pattern.search(key)]
+
+
 class WinList(Win):  # Scrollable list of items
     def __init__(self, window, ui):
         super().__init__(window, ui)
-        self.data = []
+        self._data = []
+        self._index = None
+        self._typed = ''
+        self._typed_at = 0
+        config = ui.theme.search
+        self.match = config.match
+        self.typing_timeout = config.timeout
         self.data_to_key = lambda _: _
         self.data_to_text = lambda _: _
-        self.display = lambda data, row, sel: self.addlnstr(row, 0, self.data_to_text(data)[:self.width],
-                                                            self.width, self.pair_selection if sel else self.pair_main)
+        self.display = lambda data, row, sel: self.put_line(row, self.data_to_text(data),
+                                                            self.pair_selection if sel else self.pair_main)
         self.cursor = 0
         self.offset = 0
         self.pair_main = 0
         self.pair_selection = 1
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._index = None
+
+    def index(self):
+        """Return the search index of the list, built on first use."""
+        if self._index is None:
+            self._index = KeyIndex([self.data_to_key(x) for x in self.data])
+        return self._index
+
+    def type_ahead(self, char):
+        """Move cursor to the next item matching what was just typed."""
+        now = time.monotonic()
+        if now - self._typed_at > self.typing_timeout:
+            self._typed = ''
+        self._typed_at = now
+        typed = self._typed + char.lower()
+        target = self.index().find(typed, self.match)
+        # Nothing starts with what was typed: start over from this letter,
+        # which cycles through its matches when typed again
+        if not target:
+            typed = char.lower()
+            target = self.index().find(typed, self.match)
+        self._typed = typed
+        if not target:
+            return
+        if len(typed) > 1:
+            if self.cursor not in target:
+                self.cursor = target[0]
+        elif self.cursor in target:
+            self.cursor = target[(target.index(self.cursor) + 1) % len(target)]
+        else:
+            self.cursor = target[0]
+
     def draw(self):
         self.pair_selection = self.ui.theme.pair('sel_focus' if self.focused else 'sel')
-        for i in range(min(self.height, len(self.data) - self.offset)):
+        rows = max(0, min(self.height, len(self.data) - self.offset))
+        for i in range(rows):
             self.display(self.data[i + self.offset], i, i + self.offset == self.cursor)
+        self.clear_lines(rows)
 
     def press(self, key):
         old = self.cursor
@@ -142,16 +268,7 @@ class WinList(Win):  # Scrollable list of items
             pass
         else:
             if char in string.printable and char not in string.whitespace:
-                target = [i for (i, x) in enumerate(self.data) if self.data_to_key(x).lower().startswith(char.lower())]
-                if len(target) == 1:
-                    self.cursor = target[0]
-                elif len(target) > 1:
-                    if self.cursor in target:
-                        current = target.index(self.cursor)
-                        nxt = (current + 1) % len(target)
-                        self.cursor = target[nxt]
-                    else:
-                        self.cursor = target[0]
+                self.type_ahead(char)
         if self.cursor != old:
             if self.cursor - self.offset >= self.height:
                 self.offset = self.cursor - self.height + 1
@@ -0,0 +1,136 @@
+"""Background task scheduler for DiscordZ."""
+import asyncio
+from collections import deque
+import heapq
+import itertools
+import logging
+
+log = logging.getLogger(__name__)
+
+# Priorities, most urgent first
+SEND = 0
+FOCUSED = 1
+BACKGROUND = 2
+
+
+class Job:
+    """A coroutine function waiting to be run by a Scheduler."""
+    __slots__ = ('priority', 'func', 'args', 'kwargs', 'key', 'tag', 'task', 'cancelled')
+
+    def __init__(self, priority, func, args, kwargs, key, tag):
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.tag = tag
+        self.task = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+
+class Scheduler:
+    """Run jobs by priority, at most `limit` at a time.
+
+    SEND jobs have a lane of their own: they run one at a time, in the order
+    they were submitted, and never wait for a free slot.
+    Jobs submitted with the `key` of a job that is still pending or running
+    are merged into it. Jobs can be cancelled in groups through their `tag`.
+    """
+
+    def __init__(self, limit=2):
+        self.limit = limit
+        self._heap = []
+        self._order = itertools.count()
+        self._jobs = {}  # Key -> pending or running job
+        self._running = set()
+        self._sends = deque()
+        self._sending = None
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        pending = sum(1 for (_, _, job) in self._heap if not job.cancelled)
+        pending += sum(1 for job in self._sends if not job.cancelled)
+        return pending + len(self._running) + (self._sending is not None)
+
+    def submit(self, priority, func, *args, key=None, tag=None, **kwargs):
+        """Schedule `func(*args, **kwargs)`, return its Job."""
+        job = self._jobs.get(key) if key is not None else None
+        if job is not None:
+            if job.task is not None or job.priority <= priority:
+                return job
+            # Same job, more urgent now: queue it again with the new priority
+            job.cancelled = True
+        job = Job(priority, func, args, kwargs, key, tag)
+        if key is not None:
+            self._jobs[key] = job
+        if priority == SEND:
+            self._sends.append(job)
+        else:
+            heapq.heappush(self._heap, (priority, next(self._order), job))
+        self._wakeup.set()
+        return job
+
+    def cancel(self, tag):
+        """Cancel every pending and running job with this tag."""
+        for job in self._pending():
+            if job.tag == tag:
+                self._forget(job)
+                job.cancel()
+        for job in self._started():
+            if job.tag == tag:
+                job.cancel()
+
+    def cancel_all(self):
+        for job in self._pending():
+            job.cancel()
+        for job in self._started():
+            job.cancel()
+        self._heap = []
+        self._sends.clear()
+        self._jobs = {}
+
+    def _pending(self):
+        return [job for (_, _, job) in self._heap] + list(self._sends)
+
+    def _started(self):
+        return list(self._running) + ([self._sending] if self._sending is not None else [])
+
+    async def run(self):
+        """Start jobs as slots free up, forever."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._sending is None and self._sends:
+                job = self._sends.popleft()
+                if not job.cancelled:
+                    self._sending = job
+                    job.task = asyncio.ensure_future(self._run(job))
+            while self._heap and len(self._running) < self.limit:
+                _, _, job = heapq.heappop(self._heap)
+                if job.cancelled:
+                    continue
+                self._running.add(job)
+                job.task = asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job):
+        try:
+            await job.func(*job.args, **job.kwargs)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception('task %s failed', getattr(job.func, '__qualname__', job.func))
+        finally:
+            if job is self._sending:
+                self._sending = None
+            self._running.discard(job)
+            self._forget(job)
+            self._wakeup.set()
+
+    def _forget(self, job):
+        if job.key is not None and self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
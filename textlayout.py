@@ -0,0 +1,89 @@
+"""Terminal cell width aware text layout.
+
+CJK and most emoji take two cells, combining marks and zero-width
+characters take none; Python's len() knows nothing about that.
+"""
+import functools
+import re
+import unicodedata
+
+ZERO_WIDTH = ('Mn', 'Me', 'Cf')
+_NON_ASCII = re.compile('[^\x00-\x7f]').search
+
+
+def is_ascii(text):
+    """Whether `text` is plain ASCII (str.isascii needs Python 3.7)."""
+    return _NON_ASCII(text) is None
+
+
+class _Widths(dict):
+    """Cell width of each code point, filled as they are met."""
+
+    def __missing__(self, char):
+        if unicodedata.category(char) in ZERO_WIDTH or unicodedata.combining(char):
+            value = 0
+        elif unicodedata.east_asian_width(char) in ('W', 'F'):
+            value = 2
+        else:
+            value = 1
+        self[char] = value
+        return value
+
+
+WIDTHS = _Widths()
+
+
+@functools.lru_cache(maxsize=4096)
+def width(text):
+    """Return the number of cells `text` takes."""
+    if is_ascii(text):
+        return len(text)
+    return sum(WIDTHS[char] for char in text)
+
+
+def truncate(text, cells):
+    """Return the longest start of `text` fitting in `cells` cells."""
+    if is_ascii(text):
+        return text[:cells]
+    if width(text) <= cells:
+        return text
+    used = 0
+    for i, char in enumerate(text):
+        used += WIDTHS[char]
+        if used > cells:
+            return text[:i]
+    return text
+
+
+@functools.lru_cache(maxsize=4096)
+def fit(text, cells):
+    """Truncate or pad `text` with spaces to exactly `cells` cells."""
+    text = truncate(text, cells)
+    return text + ' ' * (cells - width(text))
+
+
+def wrap(text, cells):
+    """Split `text` into lines of at most `cells` cells, breaking at spaces when possible."""
+    lines = []
+    for paragraph in text.split('\n'):
+        if width(paragraph) <= cells:
+            lines.append(paragraph)
+            continue
+        start, used, space = 0, 0, -1
+        for i, char in enumerate(paragraph):
+            if char == ' ':
+                space = i
+            used += WIDTHS[char]
+            # A character wider than the whole line still gets a line
+            if used > cells and i > start:
+                line_start = start
+                if char == ' ':
+                    end, start = i, i + 1
+                elif space > start:
+                    end, start = space, space + 1
+                else:
+                    end, start = i, i
+                lines.append(paragraph[line_start:end])
+                used = sum(WIDTHS[c] for c in paragraph[start:i + 1])
+        lines.append(paragraph[start:])
+    return lines
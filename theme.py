@@ -1,6 +1,11 @@
 """Theme handler for DiscordZ."""
+from collections import OrderedDict
 import curses
+import hashlib
+import os
+import pickle
 import toml
+import quantize
 import utils
 
 VERT = ('left', 'right')
@@ -13,11 +18,134 @@ PAIRS = {'main': ('main', 'background'),
          'sel_focus': ('selection', 'selection_background_focused'),
          'mention_icon': ('main', 'mention_notification_background')}
 
+# Bump when the compiled theme format changes
+CACHE_VERSION = 1
+THEME_ATTR_BLACKLIST = ('force_hex', 'color')
 
-def log(*x):
-    """Log."""
-    with open('out', 'a') as logs:
-        logs.write(' '.join([str(e) for e in x]) + '\n')
+
+def resolve(value):
+    """Resolve a theme color to (code, rgb, extended).
+
+    `rgb` holds the components to define a custom color with, when needed.
+    `extended` tells whether the value is an extended color code (over 15).
+    """
+    try:
+        extended = int(value) > 15
+    except ValueError:
+        extended = False
+    # Quick note about extended color codes:
+    # 0-7 are standard, binary: 0bBGR with 0% or 68% color
+    # 8-15 are somehow standard, binary: 0bBGR with 0% or 100% color
+    # 16-231 are RGB with components between 0 and 5 (216 values)
+    # 232-255 are B&W colors from black to white (24 values)
+    code = utils.color(value)
+    rgb = None
+    if code is None:
+        rgb = tuple(utils.colorx(value))
+    elif code > 15:
+        if code < 232:
+            index = code - 16
+            red, green, blue = index // 36, (index % 36) // 6, index % 6
+            rgb = tuple(x * 1000 // 6 for x in (red, green, blue))
+        else:
+            rgb = ((code - 232) * 1000 // 23,) * 3
+    return code, rgb, extended
+
+
+def compile_theme(data):
+    """Turn parsed theme data into everything Theme needs, without touching curses."""
+    data['layout']['borders'] = int(data['layout']['borders'])
+    external_data = {}
+    for key, value in data.items():
+        if key not in THEME_ATTR_BLACKLIST:
+            external_data[key] = value
+    has_hex = any(isinstance(value, str) and len(value) == 7 and value[0] == '#'
+                  for value in data['color'].values())
+    return {'force_hex': data['force_hex'],
+            'has_hex': has_hex,
+            'colors': {key: resolve(value) for (key, value) in data['color'].items()},
+            'external_data': utils.DotMap(external_data)}
+
+
+def load(path):
+    """Return the compiled theme of a TOML file, cached next to it.
+
+    The cache is used while the file's modification time and size are
+    unchanged, or its contents hash the same.
+    """
+    cache_path = path + '.cache'
+    stat = os.stat(path)
+    stamp = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    cached = None
+    try:
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['stamp'] == stamp:
+            return cached
+    except Exception:  # Missing, stale or broken cache, compile again
+        pass
+    with open(path, 'rb') as file:
+        raw = file.read()
+    digest = (CACHE_VERSION, hashlib.sha1(raw).hexdigest())
+    if cached is not None and cached.get('digest') == digest:
+        compiled = cached
+    else:
+        compiled = compile_theme(toml.loads(raw.decode('utf-8')))
+        compiled['digest'] = digest
+    compiled['stamp'] = stamp
+    try:
+        utils.write_atomic(cache_path, pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass
+    return compiled
+
+
+class Slots:
+    """A fixed range of curses slots (color pairs, colors), reused least recently used first.
+
+    `define(slot, *args)` sets a slot up and returns the value handed out for
+    it. Pinned keys keep their slot forever. Reusing a slot changes the
+    colors of whatever is still on screen with it, until it is drawn again.
+    """
+
+    def __init__(self, first, end, define):
+        self._define = define
+        self._next = first
+        self._end = end
+        self._used = OrderedDict()  # Key -> (slot, value), least recently used first
+        self._pinned = {}
+
+    def __len__(self):
+        return len(self._used) + len(self._pinned)
+
+    def get(self, key):
+        """Return the value of a key's slot, None if it has none."""
+        entry = self._pinned.get(key)
+        if entry is None:
+            entry = self._used.get(key)
+            if entry is None:
+                return None
+            self._used.move_to_end(key)
+        return entry[1]
+
+    def add(self, key, *args, pin=False):
+        """Return the value of a key's slot, setting one up if needed (None when all are pinned)."""
+        entry = self._pinned.get(key) or self._used.get(key)
+        if entry is None:
+            if self._next < self._end:
+                slot = self._next
+                self._next += 1
+            elif self._used:
+                _, (slot, _) = self._used.popitem(last=False)
+            else:
+                return None
+            entry = self._used[key] = (slot, self._define(slot, *args))
+        if key in self._used:
+            if pin:
+                self._pinned[key] = self._used.pop(key)
+            else:
+                self._used.move_to_end(key)
+        return entry[1]
 
 
 class Rect:
@@ -43,45 +171,31 @@ class Rect:
 class Theme(object):
     """Define a theme."""
 
-    THEME_ATTR_BLACKLIST = ('force_hex', 'color')
-
     def __init__(self, data):
-        if isinstance(data, str):
-            if data.endswith('.toml'):
-                with open(data) as toml_file:
-                    data = toml_file.read()
-                    print(data)
-            if data.startswith('#'):
+        if isinstance(data, str) and data.endswith('.toml'):
+            compiled = load(data)
+        else:
+            if isinstance(data, str) and data.startswith('#'):
                 data = toml.loads(data)
-                print(data)
-        if not isinstance(data, dict):
-            raise TypeError
-
-        data['layout']['borders'] = int(data['layout']['borders'])
-        external_data = {}
-        for key, value in data.items():
-            if key not in self.THEME_ATTR_BLACKLIST:
-                external_data[key] = value
-        self.external_data = utils.DotMap(external_data)
+            if not isinstance(data, dict):
+                raise TypeError
+            compiled = compile_theme(data)
+        self.external_data = compiled['external_data']
 
         curses.use_default_colors()
         self.hex = False
-        if curses.can_change_color():
-            self.hex = data['force_hex']
-            if not self.hex:
-                for value in data['color'].values():
-                    if (isinstance(value, str) and
-                            len(value) == 7 and value[0] == '#'):
-                        self.hex = True
+        self.can_change_color = curses.can_change_color()
+        if self.can_change_color:
+            self.hex = compiled['force_hex'] or compiled['has_hex']
 
         self._colors = {}
-        self._customs = 17
-        self._pairs = {}
+        # Colors up to 16 are the standard ones, see _process
+        self._customs = Slots(17, curses.COLORS, self._init_color)
+        self._pairs = Slots(1, curses.COLOR_PAIRS, self._init_pair)
         self.boxes = {}
 
-        for key, value in data['color'].items():
-            code = self._process(value)
-            self._colors[key] = code
+        for key, color in compiled['colors'].items():
+            self._colors[key] = self._process(color)
 
         for key, (fore, back) in PAIRS.items():
             self.pair(fore, back, key)
@@ -177,62 +291,71 @@ class Theme(object):
                     else:
                         window.addstr(box2_z, box_z, tee, clr)
 
-    def _process(self, value):
-        """Process a value from theme.json and returns the color code."""
-        if self.hex:
-            try:
-                code = int(value)
-            except ValueError:
-                pass
-            else:
-                if code > 15:
-                    raise ValueError('Using extended color along with hex')
-        # Quick note about extended color codes:
-        # 0-7 are standard, binary: 0bBGR with 0% or 68% color
-        # 8-15 are somehow standard, binary: 0bBGR with 0% or 100% color
-        # 16-231 are RGB with components between 0 and 5 (216 values)
-        # 232-255 are B&W colors from black to white (24 values)
-        code = utils.color(value)
-        if code is None or code > 15:
-            if code is None:
-                red, green, blue = utils.colorx(value)
-            elif code < 232:
-                code = code - 16
-                red, green, blue = code // 36, (code % 36) // 6, code % 6
-                red, green, blue = [x * 1000 // 6 for x in (red, green, blue)]
+    def _process(self, color):
+        """Return the color code of a resolved theme color, defining it if needed."""
+        code, rgb, extended = color
+        if self.hex and extended:
+            raise ValueError('Using extended color along with hex')
+        if rgb is not None:
+            if self.can_change_color or code is None:
+                code = self.add_rgb(*rgb, pin=True)
             else:
-                red, green, blue = [(code - 232) * 1000 // 23] * 3
-            code = self.add_rgb(red, green, blue)
+                # Extended codes exist as they are on 256 color terminals
+                code = quantize.nearest_code(code, curses.COLORS)
         return code
 
     def __getattr__(self, key):
         """Hacky way to use stuff."""
         return self.external_data[key]
 
-    def add_rgb(self, red, green, blue):
-        """Add RGB color to theme palette. Components up to 1000."""
-        curses.init_color(self._customs, red, green, blue)
-        self._customs += 1
-        return self._customs - 1
+    def add_rgb(self, red, green, blue, pin=False):
+        """Add RGB color to theme palette. Components up to 1000.
+
+        Colors used by the theme itself are pinned; others give their slot
+        back to newer ones when the palette is full. Terminals that can't
+        redefine colors get the nearest one of their palette instead.
+        """
+        if not self.can_change_color:
+            return quantize.nearest(red, green, blue, curses.COLORS)
+        code = self._customs.get((red, green, blue)) if not pin else None
+        if code is None:
+            code = self._customs.add((red, green, blue), red, green, blue, pin=pin)
+            if code is None:  # Every slot is pinned, use the default color
+                code = -1
+        return code
+
+    @staticmethod
+    def _init_color(code, red, green, blue):
+        curses.init_color(code, red, green, blue)
+        return code
+
+    @staticmethod
+    def _init_pair(pair, fore, back):
+        curses.init_pair(pair, fore, back)
+        return curses.color_pair(pair)
 
     def color(self, name):
         """Return the color pair corresponding to name."""
         return self._colors[name]
 
     def pair(self, fore, back=None, name=None):
-        """Return the color pair with foreground and background."""
+        """Return the color pair with foreground and background.
+
+        Named pairs are pinned, others are reused least recently used first
+        once curses runs out of pairs.
+        """
         if name is not None:
             key = name
         elif back is None:
             key = fore
         else:
             key = (fore, back)
-        if key not in self._pairs.keys():
-            pair = len(self._pairs) + 1
-            if pair < curses.COLOR_PAIRS:
-                curses.init_pair(pair, self._colors[fore], self._colors[back])
-                self._pairs[key] = pair
-        return curses.color_pair(self._pairs[key])
+        attr = self._pairs.get(key)
+        if attr is None:
+            attr = self._pairs.add(key, self._colors[fore], self._colors[back], pin=name is not None)
+            if attr is None:  # Every pair is pinned, use the default colors
+                attr = curses.color_pair(0)
+        return attr
 
     def mention(self, name):
         """Return the color pair (name, mention_background)."""
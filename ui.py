@@ -1,11 +1,19 @@
 """UI module for DiscordZ."""
+import asyncio
 import curses
+import logging
 import time
 
+import cache
+import events
+import store
 import subwin
+import tasks
 import ui_box
 import wrapper
 
+log = logging.getLogger(__name__)
+
 
 class UI:
     """UI class."""
@@ -16,13 +24,24 @@ class UI:
         self.client = client
         theme.refresh_layout(window)
         self.maxyx = window.getmaxyx()
-        self._queue = []
+        self._loading = None
+        self._render = None
+        self._scheduler = None
+        self._frame = asyncio.Event()
+        self.events = events.Coalescer()
+        self.typing = {}  # Channel id -> {user id: (name, time)}
+        self._typing_timer = None
 
         self.server = None
         self.channel = None
-
-        self.servers = {server.id: wrapper.Server(server) for server in client.servers}
-        self.servers[0] = wrapper.DirectMessages(client)
+        self.tasks = tasks.Scheduler(theme.tasks.concurrency)
+
+        config = theme.cache
+        disk = cache.DiskCache(config.path) if config.path else None
+        self.history = store.History(config.messages, config.bytes, config.channel, disk)
+        self.account = wrapper.Account(self.history)
+        self.servers = {server.id: wrapper.Server(server, self.account) for server in client.servers}
+        self.servers[0] = wrapper.DirectMessages(client, self.account)
         self.serv = ui_box.WinServ.from_rect(self)
         self.chan = ui_box.WinChan.from_rect(self)
         self.user = ui_box.WinUser.from_rect(self)
@@ -37,51 +56,165 @@ class UI:
         self._focus = None
         self.focus(self.serv if theme.get_layout('serv') is not None else self.pad)
         self.theme.borders(self.window)
-
-    def queue(self, func, *args, **kwargs):
-        self._queue.append((func, args, kwargs))
-
-    async def do(self):
-        stop = time.time() + 0.2
-        operations = 0
-        for (func, args, kwargs) in self._queue:
-            await func(*args, *kwargs)
-            operations += 1
-            if time.time() > stop:
-                break
-        self._queue = self._queue[operations:]
-
-    async def update(self):
-        for server in self.servers.values():
-            await server.update(self.client)
+        self._screen_changed = True  # Borders and background drawn on stdscr
+
+    def start(self):
+        """Start rendering, running tasks and building the channels of every server."""
+        self._render = asyncio.ensure_future(self.render())
+        self._scheduler = asyncio.ensure_future(self.tasks.run())
+        self._loading = asyncio.ensure_future(self._load_servers())
+
+    def stop(self):
+        self.tasks.cancel_all()
+        if self._typing_timer is not None:
+            self._typing_timer.cancel()
+        for task in (self._render, self._scheduler, self._loading):
+            if task is not None:
+                task.cancel()
+
+    def schedule(self):
+        """Ask for a frame to be drawn by the render task."""
+        self._frame.set()
+
+    async def render(self):
+        """Draw frames when scheduled, at most `render.fps` per second."""
+        interval = 1 / self.theme.render.fps
+        while True:
+            await self._frame.wait()
+            self._frame.clear()
+            try:
+                if self.events:
+                    self.apply(self.events.drain())
+                self.draw()
+                self.refresh()
+                # Animated boxes ask to be redrawn while drawing
+                if any(box.needs_redraw() for box in self.boxes):
+                    self._frame.set()
+            except Exception:  # Keep drawing the next frames
+                log.exception('could not draw frame')
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def redraw(*boxes):
+        """Mark boxes to be redrawn, skipping the ones the layout hides."""
+        for box in boxes:
+            if box is not None:
+                box.redraw()
+
+    def apply(self, changes):
+        """Apply the events coalesced since the last frame, marking boxes to redraw."""
+        for (server_id, _), (member, present) in changes.get(events.MEMBER, {}).items():
+            server = self.servers.get(server_id)
+            if server is None:
+                continue
+            changed = server.update_member(member) if present else server.remove_member(member)
+            if changed and server is self.server:
+                self.redraw(self.user)
+        for (channel_id, user_id), state in changes.get(events.TYPING, {}).items():
+            typing = self.typing.setdefault(channel_id, {})
+            if state is None:
+                typing.pop(user_id, None)
+            else:
+                typing[user_id] = state
+            if self.channel is not None and channel_id == self.channel.id:
+                self.redraw(self.status)
+        for channel in changes.get(events.ACTIVITY, {}).values():
+            if channel is self.channel:
+                self.redraw(self.pad)
+                continue
+            if channel.parent is self.server:
+                self.redraw(self.chan)
+            self.redraw(self.serv, self.status)
+
+    def typing_in(self, channel, timeout=10):
+        """Return the names of users who typed in a channel in the last `timeout` seconds."""
+        typing = self.typing.get(channel.id)
+        if not typing:
+            return []
+        now = time.monotonic()
+        for user_id, (_, when) in list(typing.items()):
+            if now - when > timeout:
+                del typing[user_id]
+        if typing:
+            # Draw again once the oldest of them stops typing
+            deadline = min(when for (_, when) in typing.values()) + timeout
+            if self._typing_timer is None or deadline < self._typing_timer.when():
+                if self._typing_timer is not None:
+                    self._typing_timer.cancel()
+                loop = asyncio.get_event_loop()
+                self._typing_timer = loop.call_at(loop.time() + deadline - now, self._typing_expired)
+        return [name for (name, _) in typing.values()]
+
+    def _typing_expired(self):
+        self._typing_timer = None
+        self.redraw(self.status)
+        self.schedule()
+
+    async def _load_servers(self):
+        for server in list(self.servers.values()):
+            if not server.loaded:
+                server.load()
+                # Let input and Discord events through between servers
+                await asyncio.sleep(0)
 
     def set_server(self, server):
         if self.server is not None:
             self.server.focus_off()
         self.server = server
         if server is not None:
+            server.load()
             server.focus_on()
-            print('focusing on', server.name, file=open('2.log', 'a'))
-            print(server.default_channel, file=open('2.log', 'a'))
+            if self.user is not None:
+                self.user.update()
+            log.debug('focusing on %s (default channel %s)', server.name, server.default_channel)
             if server.focused_channel is None:
                 self.set_channel(server.default_channel)
             else:
                 self.set_channel(server.focused_channel)
 
+    def send(self, channel, text):
+        """Send a message, before any other task."""
+        self.tasks.submit(tasks.SEND, self.client.send_message, channel.channel, text)
+
+    def load_older(self):
+        """Load older messages of the current channel in the background."""
+        channel = self.channel
+        if channel is None or channel.complete:
+            return
+        self.tasks.submit(tasks.BACKGROUND, self._load, channel.load_older, channel,
+                          key=('older', channel.id), tag=channel.id)
+
+    async def _load(self, load, channel):
+        await load(self.client)
+        if channel is self.channel:
+            self.pad.redraw()
+            self.schedule()
+
     def set_channel(self, channel):
-        print('setting', channel, file=open('2.log', 'a'))
+        log.debug('setting channel %s', channel)
         if self.channel is not None:
             self.channel.focus_off()
+            # Loads for the channel we're leaving aren't needed anymore
+            self.tasks.cancel(self.channel.id)
+        self.pad.scroll = 0
         self.channel = channel
         if channel is not None:
             channel.focus_on()
-            self.queue(channel.load_logs, self.client)
+            channel.load_cached()
+            self.tasks.submit(tasks.FOCUSED, self._load, channel.load_logs, channel,
+                              key=('logs', channel.id), tag=channel.id)
         if self.server is not None:
             self.server.focused_channel = channel
 
     def refresh(self):
+        """Send every staged box to the terminal at once."""
+        if self._screen_changed:
+            # Boxes are drawn over stdscr, stage it first
+            self.window.noutrefresh()
+            self._screen_changed = False
         for box in self.boxes:
             box.refresh()
+        curses.doupdate()
 
     def focus(self, box: subwin.Win):
         if self._focus == box:
@@ -109,6 +242,7 @@ class UI:
                 box.clear()
                 box.update_rect(self.theme)
             self.theme.borders(self.window)
+            self._screen_changed = True
 
         for box in self.boxes:
             if box is not None:
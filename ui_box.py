@@ -1,18 +1,23 @@
+from collections import OrderedDict
 import curses
 import curses.textpad
-import discord
+import logging
+import members
 import subwin
+import textlayout
 import utils
 import wrapper
 
+log = logging.getLogger(__name__)
+
 
 def display_item(self, item, row, sel):
     """Display a channel/server name, including mentions & unread status."""
     attr = self.pair_selection if sel else self.pair_main
     if item.unread and not item.focused:
         attr += curses.A_BOLD
-    self.addlnstr(row, 0, self.data_to_text(item)[:self.width], self.width, attr)
-    if item.mentions and not item.focused:
+    mentions = item.mentions if not item.focused else 0
+    if self.put_line(row, self.data_to_text(item), attr, mentions) and mentions:
         attr = self.ui.theme.pair('mention_icon') + curses.A_BOLD
         text = str(item.mentions)
         self.addstr(row, self.width - len(text), text, attr)
@@ -53,16 +58,15 @@ class WinChan(subwin.WinList):
         self.display = lambda i, r, s: display_item(self, i, r, s)
 
     def update(self):  # Refresh data
-        self.win.clear()
         server = self.ui.server
         self.data = server.channels
         if server.focused_channel is not None:
-            print(server.focused_channel.name, file=open('2.log', 'a'))
-            self.cursor = server.channels.index(server.focused_channel)
+            log.debug('restoring focus on %s', server.focused_channel.name)
+            self.cursor = server.position(server.focused_channel)
             if self.cursor >= self.height:
                 self.offset = self.cursor - self.height + 1
         else:
-            print('nuuuu', server.name, file=open('2.log', 'a'))
+            log.debug('no focused channel in %s', server.name)
             self.cursor = 0
         self.redraw()
 
@@ -75,9 +79,48 @@ class WinChan(subwin.WinList):
             self.redraw()
 
 
-class WinUser(subwin.Win):
+class WinUser(subwin.WinList):
+    """Member list box, only drawing the visible rows."""
     win_name = 'user'
 
+    def __init__(self, window, ui):
+        super().__init__(window, ui)
+        self.data_to_key = lambda m: m.display_name
+        self.data_to_text = lambda m: m.display_name
+        self.display = self.display_member
+        self.data = members.MemberList()
+        self._version = None
+
+    def index(self):
+        # Members move around, rebuild the search index when they did
+        if self._version != self.data.version:
+            self._version = self.data.version
+            self._index = None
+        return super().index()
+
+    def display_member(self, member, row, sel):
+        status = members.status(member)
+        if status not in ('online', 'idle'):
+            status = 'idle' if status == 'dnd' else 'offline'
+        attr = self.pair_selection if sel else self.pair_main
+        text = '%s %s' % (self.ui.theme.chars[status], member.display_name)
+        if self.put_line(row, text, attr, status):
+            self.addstr(row, 0, self.ui.theme.chars[status], self.ui.theme.pair(status, 'background'))
+
+    def update(self):  # Refresh data
+        self.data = self.ui.server.member_list()
+        self._version = self.data.version
+        self.cursor = 0
+        self.offset = 0
+        self.redraw()
+
+    def draw(self):
+        # Keep the cursor in the list as members leave
+        if self.cursor >= len(self.data):
+            self.cursor = max(0, len(self.data) - 1)
+        self.offset = max(0, min(self.offset, len(self.data) - self.height))
+        super().draw()
+
 
 class WinStatus(subwin.Win):
     """Status."""
@@ -96,14 +139,22 @@ class WinStatus(subwin.Win):
                 if channel.is_private is None:
                     message += '@'
                 message += channel.display_name
+                typing = self.ui.typing_in(channel)
+                if typing:
+                    message += ' (%s typing)' % ', '.join(typing)
                 if not channel.is_private and channel.topic is not None and len(channel.topic.strip()) > 0:
                     message += ' - '
-                    max_length = self.width - len(message)
-                    if len(channel.topic) > max_length:
+                    max_length = self.width - textlayout.width(message)
+                    if textlayout.width(channel.topic) > max_length:
                         self.redraw()
                     message += utils.slide_text(self.ui.channel.topic, max_length, max_length // 3, 0.1)
-        self.clear()
-        self.addstr(0, 0, message, self.ui.theme.pair('main'))
+        account = self.ui.account
+        counts = (account.mentions, account.private_mentions)
+        if self.put_line(0, message, self.ui.theme.pair('main'), counts) and account.mentions:
+            text = ' %d ' % account.mentions
+            if account.private_mentions:
+                text = ' %d (%d DM) ' % (account.mentions, account.private_mentions)
+            self.addstr(0, self.width - len(text) - 1, text, self.ui.theme.pair('mention_icon') + curses.A_BOLD)
 
 
 class WinBox(subwin.Win):
@@ -123,22 +174,80 @@ class WinBox(subwin.Win):
     def press(self, key):
         if self.ui.channel is not None:
             if key == 10:
-                self.ui.queue(self.ui.client.send_message, self.ui.channel.channel, self.text.gather())
-                self.clear()
+                self.ui.send(self.ui.channel, self.text.gather())
+                self.erase()
             else:
                 self.text.do_command(key)
+            self.redraw()
 
 
 class WinPad(subwin.Win):
     """Main chat box."""
     win_name = 'pad'
+    # Start loading older messages when this many lines from the top of the history
+    PREFETCH = 40
+    # Messages whose wrapped lines are kept
+    CACHE_SIZE = 4096
+
+    def __init__(self, window, ui):
+        super().__init__(window, ui)
+        self.scroll = 0  # Number of lines hidden below the view
+        self._wrapped = OrderedDict()
+
+    def update_rect(self, theme):
+        super().update_rect(theme)
+        self._wrapped.clear()
+
+    def lines(self, message):
+        """Return the lines of a message wrapped to the box width, cached."""
+        key = (message.id, message.edited, self.width)
+        lines = self._wrapped.get(key)
+        if lines is None:
+            lines = textlayout.wrap('%s: %s' % (message.author, message.content), self.width)
+            self._wrapped[key] = lines
+            if len(self._wrapped) > self.CACHE_SIZE:
+                self._wrapped.popitem(last=False)
+        else:
+            self._wrapped.move_to_end(key)
+        return lines
 
     def draw(self):
-        log = []
-        if self.ui.channel is not None:
-            log.extend(self.ui.channel.messages[:self.height][::-1])
-        self.clear()
-        for i, message in enumerate(log):
-            auth, serv, text = message.author, message.server, message.content
-            name = (auth.nick or auth.name) if isinstance(auth, discord.Member) else auth.name
-            self.addstr(i, 0, '%s: %s' % (name, text))
+        # Lay out messages from the newest, only as far up as the view goes
+        chunks = []
+        count = 0
+        wanted = self.height + self.scroll + self.PREFETCH
+        messages = self.ui.channel.messages if self.ui.channel is not None else ()
+        position = len(messages) - 1
+        while position >= 0 and count < wanted:
+            lines = self.lines(messages[position])
+            chunks.append(lines)
+            count += len(lines)
+            position -= 1
+        log = [line for lines in reversed(chunks) for line in lines]
+        if position < 0:
+            self.scroll = max(0, min(self.scroll, len(log) - self.height))
+            if self.scroll > 0:
+                self.ui.load_older()
+        end = len(log) - self.scroll
+        log = log[max(0, end - self.height):end]
+        for i, line in enumerate(log):
+            self.put_line(i, line)
+        self.clear_lines(len(log))
+
+    def press(self, key):
+        if self.ui.channel is None:
+            return
+        old = self.scroll
+        if key == 259:                  # Up
+            self.scroll += 1
+        if key == 258:                  # Down
+            self.scroll -= 1
+        if key == 339:                  # Page Up
+            self.scroll += self.height - 1
+        if key == 338:                  # Page Down
+            self.scroll -= self.height - 1
+        if key == 360:                  # End
+            self.scroll = 0
+        self.scroll = max(0, self.scroll)
+        if self.scroll != old:
+            self.redraw()
@@ -1,6 +1,8 @@
 """Various utility functions."""
 from collections import OrderedDict
 from inspect import ismethod
+import os
+import tempfile
 import time
 import discord
 
@@ -37,6 +39,21 @@ def colorx(hexcode):
     return [int(hexcode[i:i+2], 16) * 1000 // 255 for i in range(0, 6, 2)]
 
 
+def write_atomic(path, data):
+    """Write bytes to a file through a temporary file, so nobody reads half of it."""
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
 def slide_text(text, max_length, space=-1, speed=0.2):
     """Fancy horizontal text-scrolling for small spaces."""
     if len(text) <= max_length:
@@ -91,6 +108,13 @@ class DotMap(OrderedDict):
         else:
             return self[key]
 
+    def __reduce__(self):
+        # Pickle the contents, not the (empty) dict DotMap inherits from
+        return (DotMap, (), self._map)
+
+    def __setstate__(self, state):
+        self._map = state
+
     def __str__(self):
         items = []
         for key, val in self.__call_items(self._map):
@@ -1,5 +1,8 @@
 import discord
 
+import members
+import store
+
 
 class Common:
     def __init__(self):
@@ -12,84 +15,190 @@ class Common:
         self.focused = False
 
 
+class Account:
+    """Root of the wrappers, holding totals over every server."""
+
+    def __init__(self, history: store.History):
+        self.history = history
+        self.channels = {}  # Every channel wrapper, by id
+        self.mentions = 0
+        self.private_mentions = 0
+        self.unread_servers = 0
+
+    def count(self, server, mentions, unread):
+        """Apply mention and unread server count changes."""
+        self.mentions += mentions
+        if isinstance(server, DirectMessages):
+            self.private_mentions += mentions
+        self.unread_servers += unread
+
+
 class Channel(Common):
     """Wrapper around discord.Channel."""
-    msg_sort = (lambda m: m.timestamp.timestamp())
 
-    def __init__(self, channel: discord.Channel):
+    def __init__(self, channel: discord.Channel, parent):
         super(Channel, self).__init__()
+        self.parent = parent
+        self.history = parent.history
+        self.messages = self.history.open()
+        self.synced = False
+        self._first = None  # Id of the first message of the channel, once reached
+        self._unread = False
+        self._mentions = 0
+        self.set_channel(channel)
+
+    def __getattr__(self, key):
+        return self.channel.__getattribute__(key)
+
+    def set_channel(self, channel):
+        """Replace the wrapped channel (after an update)."""
         self.channel = channel
-        self.messages = []
-        self.unread = False
-        self.mentions = 0
         self.name = channel.name
         self.display_name = None if channel.name is None else '#' + self.name
 
-    def __getattr__(self, key):
-        return self.channel.__getattribute__(key)
+    @property
+    def complete(self):
+        """Whether the first message of the channel is loaded (it may have been dropped since)."""
+        oldest = self.messages.oldest()
+        return oldest is not None and oldest.id == self._first
+
+    @property
+    def mentions(self):
+        return self._mentions
+
+    @mentions.setter
+    def mentions(self, value):
+        self.parent.count(value - self._mentions, 0)
+        self._mentions = value
+
+    @property
+    def unread(self):
+        return self._unread
+
+    @unread.setter
+    def unread(self, value):
+        value = bool(value)
+        if value != self._unread:
+            self.parent.count(0, 1 if value else -1)
+        self._unread = value
 
     def focus_on(self):
         super(Channel, self).focus_on()
+        self.history.pin(self.messages)
+        self.mark_read()
+
+    def focus_off(self):
+        super(Channel, self).focus_off()
+        self.history.unpin(self.messages)
+
+    def close(self):
+        """Release the channel's history and counters."""
         self.mark_read()
+        self.history.close(self.messages)
 
     def mark_read(self):
         self.mentions = 0
-        self.unread = 0
+        self.unread = False
 
     async def update(self, client):
         await self.load_logs(client)
 
+    def load_cached(self, limit=100):
+        """Fill the history from the disk cache, up to `limit` messages."""
+        cache = self.history.cache
+        if cache is None or len(self.messages) >= limit:
+            return 0
+        oldest = self.messages.oldest()
+        records = cache.load(self.id, limit - len(self.messages), None if oldest is None else oldest.id)
+        for record in records:
+            self.messages.add(record)
+        return len(records)
+
+    async def load_older(self, client, limit=50):
+        """Load a page of messages older than the oldest one loaded."""
+        oldest = self.messages.oldest()
+        if self.complete or oldest is None:
+            return
+        # Scrollback is allowed past the ring buffer size, until focus is lost
+        if self.messages.limit is not None:
+            self.messages.limit = max(self.messages.limit, len(self.messages) + limit)
+        loaded = self.load_cached(len(self.messages) + limit)
+        if loaded >= limit:
+            return
+        messages = []
+        try:
+            before = discord.Object(id=self.messages.oldest().id)
+            async for message in client.logs_from(self, limit=limit - loaded, before=before):
+                messages.append(message)
+        except discord.Forbidden:
+            pass
+        self._add_messages(messages)
+        if len(messages) < limit - loaded:
+            self._first = self.messages.oldest().id
+
     async def load_logs(self, client, limit=100):
-        if len(self.messages) >= limit:
+        self.load_cached(limit)
+        if self.synced and len(self.messages) >= limit:
             return
+        after = None
+        if not self.synced and self.history.cache is not None:
+            # Only fetch what was posted since the last session
+            mark = self.history.cache.marks.get(self.id)
+            if mark is not None:
+                after = discord.Object(id=mark)
+        messages = []
         try:
-            async for message in client.logs_from(self, limit=limit):
-                self._add_message(message)
+            async for message in client.logs_from(self, limit=limit, after=after):
+                messages.append(message)
+            if after is not None and len(messages) >= limit:
+                # Too much was missed to catch up: the cached messages would be
+                # followed by a hole, start over from the newest messages instead
+                self.messages.clear()
+                self.history.cache.clear(self.id)
+                self._first = None
+                messages = []
+                async for message in client.logs_from(self, limit=limit):
+                    messages.append(message)
         except discord.Forbidden:
             pass
-        self.sort_messages()
+        self.synced = True
+        self._add_messages(messages)
 
     def has_message(self, message):
-        for m in self.messages:
-            if m.id == message.id:
-                return True
-        return False
+        return message in self.messages
 
     def find_message(self, message):
-        for i, m in enumerate(self.messages):
-            if m.id == message.id:
-                return i
-        return -1
+        return self.messages.position(message)
 
-    def sort_messages(self):
-        self.messages.sort(key=Channel.msg_sort, reverse=True)
-
-    def _add_message(self, message):
-        if not self.has_message(message):
-            self.messages.append(message)
-            return True
-        return False
+    def _add_messages(self, messages):
+        records = [store.Record.from_message(message) for message in messages]
+        records = [record for record in records if self.messages.add(record)]
+        if records and self.history.cache is not None:
+            self.history.cache.save(self.id, records)
 
     def add_message(self, message):
-        if self._add_message(message):
-            self.sort_messages()
+        self._add_messages([message])
 
     def delete_message(self, message):
-        if not self.has_message(message):
-            return
-        del self.messages[self.find_message(message)]
+        self.messages.remove(message)
+        if self.history.cache is not None:
+            self.history.cache.delete(self.id, message.id)
 
     def edit_message(self, before, after):
-        if not self.has_message(before):
-            self.add_message(after)
-        else:
-            self.messages[self.find_message(before)] = after
+        record = store.Record.from_message(after)
+        # An edit of a message that isn't loaded only goes to disk: adding it
+        # would break the store running up to the newest message
+        if self.messages.replace(record):
+            if self.history.cache is not None:
+                self.history.cache.save(self.id, [record])
+        elif self.history.cache is not None:
+            self.history.cache.update(self.id, record)
 
 
 class PrivateChannel(Channel):
     """Wrapper around discord.PrivateChannel."""
-    def __init__(self, channel: discord.PrivateChannel):
-        super().__init__(channel)
+    def set_channel(self, channel):
+        self.channel = channel
         if channel.name is not None:
             self.name = channel.name
         else:
@@ -99,50 +208,165 @@ class PrivateChannel(Channel):
 
 class Server(Common):
     """Wrapper around discord.Server."""
-    def __init__(self, server: discord.Server):
+    def __init__(self, server: discord.Server, account: Account):
         super(Server, self).__init__()
         self.server = server
+        self.account = account
+        self.history = account.history
+        self.mentions = 0
+        self.unread_channels = 0
+        self.loaded = False
         self.channels = []
+        self._index = {}
+        self._positions = {}
         self.focused_channel = None
         self.default_channel = None
+        self.members = None
 
     def __getitem__(self, key):
-        for channel in self.channels:
-            if channel is key or channel.channel is key or channel.id == key:
-                return channel
+        return self._index.get(getattr(key, 'id', key))
 
     def __getattr__(self, key):
-        if key == 'mentions':
-            return sum([channel.mentions for channel in self.channels])
-        elif key == 'unread':
-            return any([channel.unread for channel in self.channels])
-        else:
-            return self.server.__getattribute__(key)
+        return self.server.__getattribute__(key)
+
+    @property
+    def unread(self):
+        return self.unread_channels > 0
+
+    def count(self, mentions, unread):
+        """Apply mention and unread channel count changes from a channel."""
+        was_unread = self.unread
+        self.mentions += mentions
+        self.unread_channels += unread
+        self.account.count(self, mentions, self.unread - was_unread)
 
     def mark_read(self):
         for channel in self.channels:
             channel.mark_read()
 
-    async def update(self, client):
-        self.channels = [Channel(channel) for channel in self.server.channels if channel.type is discord.ChannelType.text]
+    def position(self, channel):
+        """Return the index of a channel in the channel list."""
+        return self._positions[channel.id]
+
+    def wrap(self, channel):
+        """Return a wrapper around a discord channel, or None to ignore it."""
+        if channel.type is not discord.ChannelType.text:
+            return None
+        return Channel(channel, self)
+
+    def sort(self):
         self.channels.sort(key=lambda c: c.position)
-        self.default_channel = self.channels[0] if self.server is None else self[self.server.default_channel]
+        self._positions = {channel.id: i for (i, channel) in enumerate(self.channels)}
+
+    def add_channel(self, channel):
+        """Wrap and add a channel, return the wrapper (or None)."""
+        wrapped = self.wrap(channel)
+        if wrapped is None:
+            return None
+        self.channels.append(wrapped)
+        self._index[wrapped.id] = wrapped
+        self.account.channels[wrapped.id] = wrapped
+        self.sort()
+        return wrapped
+
+    def remove_channel(self, channel):
+        """Remove a channel, return its wrapper (or None)."""
+        wrapped = self._index.pop(channel.id, None)
+        if wrapped is None:
+            return None
+        self.channels.remove(wrapped)
+        self.account.channels.pop(wrapped.id, None)
+        wrapped.close()
+        self.sort()
+        if self.focused_channel is wrapped:
+            self.focused_channel = None
+        if self.default_channel is wrapped:
+            self.default_channel = self.channels[0] if self.channels else None
+        return wrapped
+
+    def update_channel(self, channel):
+        """Apply a channel update, return its wrapper (or None)."""
+        wrapped = self._index.get(channel.id)
+        if wrapped is None:
+            return self.add_channel(channel)
+        wrapped.set_channel(channel)
+        self.sort()
+        return wrapped
+
+    def close(self):
+        for channel in self.channels:
+            self.account.channels.pop(channel.id, None)
+            channel.close()
+        self.channels = []
+        self._index = {}
+        self._positions = {}
+
+    def set_channels(self, channels):
+        """Replace the channel list."""
+        self.close()
+        for channel in channels:
+            wrapped = self.wrap(channel)
+            if wrapped is not None:
+                self.channels.append(wrapped)
+                self._index[wrapped.id] = wrapped
+                self.account.channels[wrapped.id] = wrapped
+        self.sort()
+
+    def load(self):
+        """Build the channel wrappers, unless already done."""
+        if self.loaded:
+            return
+        self.loaded = True
+        self.set_channels(self.server.channels)
+        self.default_channel = self[self.server.default_channel] or (self.channels[0] if self.channels else None)
+
+    def member_list(self):
+        """Return the sorted member list, built on first use and kept up to date after."""
+        if self.members is None:
+            self.members = members.MemberList(self.server.members)
+        return self.members
+
+    def update_member(self, member):
+        """Add or move a member, return whether the member list changed."""
+        if self.members is None:
+            return False
+        self.members.update(member)
+        return True
+
+    def remove_member(self, member):
+        """Remove a member, return whether the member list changed."""
+        if self.members is None:
+            return False
+        self.members.remove(member)
+        return True
 
 
 class DirectMessages(Server):
     """Fake server handling all the private channels."""
-    def __init__(self, client):
-        super(DirectMessages, self).__init__(None)
+    def __init__(self, client, account: Account):
+        super(DirectMessages, self).__init__(None, account)
         self.id = 0
         self.name = 'Friends'
-        self.channels = [PrivateChannel(channel) for channel in client.private_channels]
-        self.default_channel = self.channels[0]
+        self.client = client
 
-    async def update(self, client):
-        self.channels = [PrivateChannel(channel) for channel in client.private_channels]
+    def wrap(self, channel):
+        return PrivateChannel(channel, self)
+
+    def sort(self):
+        self._positions = {channel.id: i for (i, channel) in enumerate(self.channels)}
+
+    def member_list(self):
+        if self.members is None:
+            self.members = members.MemberList()
+        return self.members
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        self.set_channels(self.client.private_channels)
         # for channel in self.channels:
         #     if len(channel.messages) == 0:
         #         await channel.load_logs(client, 1)
         # self.channels.sort(key=lambda c: c.messages[0].timestamp, reverse=True)
-        self.default_channel = self.channels[0]
-
+        self.default_channel = self.channels[0] if self.channels else None